@@ -1,19 +1,54 @@
 from __future__ import annotations
 from prefect import flow, task, get_run_logger
 from prefect.states import Failed
+# Requiere Prefect 3 (cache_policies y tareas lanzadas desde otras tareas)
+from prefect.cache_policies import NO_CACHE
 from typing import Dict, Any
 from pathlib import Path
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import pandas as pd
+import numpy as np
 import sqlite3
 import xml.etree.ElementTree as ET
+import atexit
 import json
 import logging
+import os
+
+# Copy-on-Write: las selecciones no copian datos hasta que se modifican
+# (siempre activo desde pandas 3.0)
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.options.mode.copy_on_write = True
+
+try:
+    import pyarrow as pa
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
 
 DATA_DIR = Path(__file__).resolve().parents[1] / "data"
 DB_PATH = DATA_DIR / "etl.db"
 FINAL_PARQUET = DATA_DIR / "df_final.parquet"
 LOG_PATH = DATA_DIR / "etl.log"
+# Copias raw de los datos extraídos (desactivadas por defecto)
+SAVE_RAW = os.getenv("ETL_SAVE_RAW", "0") == "1"
+# Límite de parámetros por sentencia en SQLite (>= 3.32)
+SQLITE_MAX_VARIABLES = 32_766
+# Opciones de escritura Parquet: zstd, diccionario y row groups grandes con estadísticas
+PARQUET_OPTS = {
+    "engine": "pyarrow",
+    "compression": "zstd",
+    "compression_level": 3,
+    "use_dictionary": True,
+    "row_group_size": 128_000,
+    "data_page_size": 1 << 20,
+    "write_statistics": True,
+    "index": False,
+}
+# Tabla de traducción para correos: quita tildes y espacios en una sola pasada
+_ACCENT_TBL = str.maketrans({'á': 'a', 'é': 'e', 'í': 'i', 'ó': 'o', 'ú': 'u', ' ': ''})
 
 def setup_logging():
     """Configura el sistema de logging para el ETL"""
@@ -51,8 +86,125 @@ def setup_logging():
 # Configurar logging al inicio
 etl_logger = setup_logging()
 
-@task
+# Tabla de monitoreo: el DDL se ejecuta una sola vez, al abrir la conexión de monitoreo
+_MONITOR_DDL = """
+    CREATE TABLE IF NOT EXISTS etl_monitor (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run_ts TEXT,
+        registros_leidos INTEGER,
+        registros_validos INTEGER,
+        registros_descartados INTEGER,
+        alumnos_con_matricula INTEGER,
+        total_alumnos_unicos INTEGER,
+        total_materias_diferentes INTEGER,
+        correos_generados INTEGER,
+        promedio_notas_general REAL,
+        duracion_s TEXT,
+        estado TEXT,
+        mensaje TEXT
+    );
+"""
+_INSERT_SQL = """
+    INSERT INTO etl_monitor(run_ts, registros_leidos, registros_validos, registros_descartados, alumnos_con_matricula, total_alumnos_unicos, total_materias_diferentes, correos_generados, promedio_notas_general, duracion_s, estado, mensaje)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def _init_monitor() -> sqlite3.Connection:
+    """Abre la conexión de monitoreo (autocommit, WAL) y crea etl_monitor si no existe"""
+    conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False)
+    # WAL: las escrituras del monitor no bloquean la carga de 'hechos'
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(_MONITOR_DDL)
+    return conn
+
+# Conexión compartida, abierta en el primer log_run (importar el módulo no toca etl.db);
+# sqlite3 reutiliza la sentencia INSERT preparada entre corridas
+_monitor_conn: sqlite3.Connection | None = None
+
+def _get_monitor() -> sqlite3.Connection:
+    """Devuelve la conexión de monitoreo, abriéndola (y registrando su cierre) la primera vez"""
+    global _monitor_conn
+    if _monitor_conn is None:
+        _monitor_conn = _init_monitor()
+        atexit.register(_monitor_conn.close)
+    return _monitor_conn
+
+# Opciones de las tareas con DataFrames: resultados en memoria, sin persistir ni
+# serializar, y sin caché (no se calcula el hash de los DataFrames de entrada)
+RESULT_OPTS: Dict[str, Any] = {"persist_result": False, "cache_policy": NO_CACHE}
+
+def _parse_matriculas_xml(path: Path) -> pd.DataFrame:
+    """Lee matriculas.xml en streaming (iterparse) acumulando columnas en un dict de listas"""
+    cols: Dict[str, list] = defaultdict(list)
+    n_rows = 0
+    context = ET.iterparse(path, events=("start", "end"))
+    _, root = next(context)
+    for event, elem in context:
+        if event != "end" or elem.tag != "matricula":
+            continue
+        for child in elem:
+            col = cols[child.tag]
+            # Rellenar con None si la etiqueta aparece por primera vez
+            col.extend([None] * (n_rows - len(col)))
+            col.append(child.text)
+        n_rows += 1
+        # Liberar el elemento procesado y sus hermanos anteriores
+        elem.clear()
+        root.clear()
+    for col in cols.values():
+        col.extend([None] * (n_rows - len(col)))
+    return pd.DataFrame(cols)
+
+@task(**RESULT_OPTS)
+def read_csv_al() -> pd.DataFrame:
+    """Lee alumnos.csv"""
+    alumnos_csv = DATA_DIR / "alumnos.csv"
+    etl_logger.info(f"Leyendo archivo de alumnos: {alumnos_csv}")
+    if HAS_PYARROW:
+        # Parser multihilo de pyarrow con columnas respaldadas por Arrow
+        df_al = pd.read_csv(alumnos_csv, engine="pyarrow", dtype_backend="pyarrow")
+        # Columnas de texto fijas (una columna vacía se inferiría como null[pyarrow])
+        # y fechas conservadas como texto (columna TEXT en 'hechos', como antes)
+        df_al = df_al.astype({
+            c: pd.ArrowDtype(pa.string()) for c, dt in df_al.dtypes.items()
+            if c in ('id_alumno', 'nombre', 'apellido', 'correo')
+            or (isinstance(dt, pd.ArrowDtype) and pa.types.is_date(dt.pyarrow_dtype))
+        })
+    else:
+        # Tipos fijos para evitar la inferencia del motor C
+        df_al = pd.read_csv(alumnos_csv, dtype={
+            'id_alumno': 'string', 'nombre': 'string',
+            'apellido': 'string', 'correo': 'string',
+        })
+    etl_logger.info(f"Alumnos leídos: {len(df_al)} registros")
+    return df_al
+
+@task(**RESULT_OPTS)
+def read_json_ca() -> pd.DataFrame:
+    """Lee calificaciones.json"""
+    calif_json = DATA_DIR / "calificaciones.json"
+    etl_logger.info(f"Leyendo archivo de calificaciones: {calif_json}")
+    if HAS_PYARROW:
+        # El archivo es un arreglo JSON (no NDJSON): columnas respaldadas por Arrow
+        df_ca = pd.read_json(calif_json, orient="records", lines=False, dtype_backend="pyarrow")
+    else:
+        df_ca = pd.read_json(calif_json, orient="records", lines=False)
+    etl_logger.info(f"Calificaciones leídas: {len(df_ca)} registros")
+    return df_ca
+
+@task(**RESULT_OPTS)
+def read_xml_ma() -> pd.DataFrame:
+    """Lee matriculas.xml"""
+    matric_xml = DATA_DIR / "matriculas.xml"
+    etl_logger.info(f"Leyendo archivo de matrículas: {matric_xml}")
+    # XML -> DataFrame (streaming, sin construir el DOM completo)
+    df_ma = _parse_matriculas_xml(matric_xml)
+    etl_logger.info(f"Matrículas leídas: {len(df_ma)} registros")
+    return df_ma
+
+@task(**RESULT_OPTS)
 def extract() -> Dict[str, Any]:
+    """Lanza las tres lecturas en paralelo y consolida sus resultados"""
     logger = get_run_logger()
     start = datetime.utcnow()
     
@@ -61,50 +213,45 @@ def extract() -> Dict[str, Any]:
     etl_logger.info(f"Timestamp de inicio: {start.isoformat()}")
 
     try:
-        alumnos_csv = DATA_DIR / "alumnos.csv"
-        calif_json = DATA_DIR / "calificaciones.json"
-        matric_xml = DATA_DIR / "matriculas.xml"
-        
-        etl_logger.info(f"Leyendo archivo de alumnos: {alumnos_csv}")
-        df_al = pd.read_csv(alumnos_csv)
-        etl_logger.info(f"Alumnos leídos: {len(df_al)} registros")
-        
-        etl_logger.info(f"Leyendo archivo de calificaciones: {calif_json}")
-        df_ca = pd.read_json(calif_json, orient="records", lines=False)
-        etl_logger.info(f"Calificaciones leídas: {len(df_ca)} registros")
-
-        etl_logger.info(f"Leyendo archivo de matrículas: {matric_xml}")
-        # XML -> DataFrame
-        tree = ET.parse(matric_xml)
-        root = tree.getroot()
-        rows = []
-        for r in root.findall(".//matricula"):
-            rows.append({child.tag: child.text for child in r})
-        df_ma = pd.DataFrame(rows)
-        etl_logger.info(f"Matrículas leídas: {len(df_ma)} registros")
-
-        # Copias raw (opcionales)
-        etl_logger.info("Generando copias raw de los datos originales")
-        df_al.to_csv(DATA_DIR / "raw_alumnos.csv", index=False)
-        df_ca.to_json(DATA_DIR / "raw_calificaciones.json", orient="records", indent=2)
-        df_ma.to_csv(DATA_DIR / "raw_matriculas.csv", index=False)
-        etl_logger.info("Copias raw generadas exitosamente")
+        # Las tres lecturas son independientes: se lanzan en paralelo desde esta
+        # tarea (Prefect 3) para que la duración y el manejo de errores las incluyan
+        f_al = read_csv_al.submit()
+        f_ca = read_json_ca.submit()
+        f_ma = read_xml_ma.submit()
+        df_al, df_ca, df_ma = f_al.result(), f_ca.result(), f_ma.result()
+
+        # Copias raw (opcionales): se escriben en Parquet en segundo plano; el
+        # bloque with cierra el pool (y espera las escrituras) también si hay error
+        with ThreadPoolExecutor(max_workers=3) as raw_executor:
+            raw_futs = []
+            if SAVE_RAW:
+                etl_logger.info("Generando copias raw de los datos originales")
+                raw_futs = [
+                    raw_executor.submit(df.to_parquet, DATA_DIR / f"raw_{nombre}.parquet", **PARQUET_OPTS)
+                    for nombre, df in (("alumnos", df_al), ("calificaciones", df_ca), ("matriculas", df_ma))
+                ]
+
+            end = datetime.utcnow()
+            duration = (end - start).total_seconds()
+            
+            metrics = {
+                "ts_extract": start.isoformat(),
+                "alumnos_rows": int(len(df_al)),
+                "calificaciones_rows": int(len(df_ca)),
+                "matriculas_rows": int(len(df_ma)),
+            }
+            
+            etl_logger.info(f"=== EXTRACCIÓN COMPLETADA EXITOSAMENTE ===")
+            etl_logger.info(f"Duración: {duration:.2f} segundos")
+            total_registros = metrics["alumnos_rows"] + metrics["calificaciones_rows"] + metrics["matriculas_rows"]
+            etl_logger.info(f"Total registros extraídos: {total_registros}")
+            
+            # Esperar las copias raw antes de entregar los DataFrames
+            if raw_futs:
+                for fut in raw_futs:
+                    fut.result()
+                etl_logger.info("Copias raw generadas exitosamente")
 
-        end = datetime.utcnow()
-        duration = (end - start).total_seconds()
-        
-        metrics = {
-            "ts_extract": start.isoformat(),
-            "alumnos_rows": int(len(df_al)),
-            "calificaciones_rows": int(len(df_ca)),
-            "matriculas_rows": int(len(df_ma)),
-        }
-        
-        etl_logger.info(f"=== EXTRACCIÓN COMPLETADA EXITOSAMENTE ===")
-        etl_logger.info(f"Duración: {duration:.2f} segundos")
-        total_registros = metrics["alumnos_rows"] + metrics["calificaciones_rows"] + metrics["matriculas_rows"]
-        etl_logger.info(f"Total registros extraídos: {total_registros}")
-        
         logger.info(f"EXTRACT OK: {metrics}")
         return {"al": df_al, "ca": df_ca, "ma": df_ma, "metrics": metrics}
         
@@ -113,8 +260,8 @@ def extract() -> Dict[str, Any]:
         etl_logger.error(f"Tipo de error: {type(e).__name__}")
         raise
 
-@task
-def transform(dfs: Dict[str, Any]) -> Dict[str, Any]:
+@task(**RESULT_OPTS)
+def transform(dfs: Dict[str, Any], save_parquet: bool = False) -> Dict[str, Any]:
     logger = get_run_logger()
     start = datetime.utcnow()
     
@@ -123,9 +270,11 @@ def transform(dfs: Dict[str, Any]) -> Dict[str, Any]:
     etl_logger.info(f"Timestamp de inicio: {start.isoformat()}")
 
     try:
-        df_al = dfs["al"].copy()
-        df_ca = dfs["ca"].copy()
-        df_ma = dfs["ma"].copy()
+        # Con Copy-on-Write basta una copia superficial: las columnas se comparten
+        # hasta que se reasignan, sin tocar los DataFrames de entrada
+        df_al = dfs["al"].copy(deep=False)
+        df_ca = dfs["ca"].copy(deep=False)
+        df_ma = dfs["ma"]
         
         etl_logger.info(f"Datos recibidos - Alumnos: {len(df_al)}, Calificaciones: {len(df_ca)}, Matrículas: {len(df_ma)}")
 
@@ -141,48 +290,40 @@ def transform(dfs: Dict[str, Any]) -> Dict[str, Any]:
         
         # 2. Generar correos faltantes
         etl_logger.info("Generando correos electrónicos faltantes")
-        def generar_correo(row):
-            """Genera correo si está faltante usando formato nombre+apellido@colegio.edu"""
-            if pd.isna(row['correo']) or row['correo'] == '':
-                nombre = str(row['nombre']).lower().strip()
-                apellido = str(row['apellido']).lower().strip()
-                # Remover espacios y caracteres especiales
-                nombre_limpio = nombre.replace(' ', '').replace('á', 'a').replace('é', 'e').replace('í', 'i').replace('ó', 'o').replace('ú', 'u')
-                apellido_limpio = apellido.replace(' ', '').replace('á', 'a').replace('é', 'e').replace('í', 'i').replace('ó', 'o').replace('ú', 'u')
-                return f"{nombre_limpio}.{apellido_limpio}@colegio.edu"
-            return row['correo']
-        
-        # Contar correos faltantes antes
-        correos_faltantes_antes = df_al['correo'].isna().sum()
+
+        def limpiar_texto(serie: pd.Series) -> pd.Series:
+            """Pasa a minúsculas y quita tildes y espacios con _ACCENT_TBL"""
+            return serie.str.lower().str.strip().str.translate(_ACCENT_TBL)
+
+        # Contar correos faltantes antes (nulos o vacíos, máscara calculada una vez)
+        mask_sin_correo = df_al['correo'].fillna('').eq('')
+        correos_faltantes_antes = int(mask_sin_correo.sum())
         etl_logger.info(f"Correos faltantes encontrados: {correos_faltantes_antes}")
-        
-        # Aplicar generación de correos
-        df_al['correo'] = df_al.apply(generar_correo, axis=1)
-        
+
+        # Correo generado con formato nombre.apellido@colegio.edu, solo para las filas sin correo
+        if correos_faltantes_antes:
+            sin_correo = df_al.loc[mask_sin_correo, ['nombre', 'apellido']]
+            generados = limpiar_texto(sin_correo['nombre']) + '.' + limpiar_texto(sin_correo['apellido']) + '@colegio.edu'
+            df_al['correo'] = df_al['correo'].mask(mask_sin_correo, generados)
+
         # Contar correos generados
         correos_faltantes_despues = df_al['correo'].isna().sum()
-        correos_generados = correos_faltantes_antes - correos_faltantes_despues
-        
+        correos_generados = int(mask_sin_correo.sum())
+
         etl_logger.info(f"Correos generados automáticamente: {correos_generados}")
         logger.info(f"Correos generados automáticamente: {correos_generados}")
         logger.info(f"Correos faltantes restantes: {correos_faltantes_despues}")
         
         # 3. Redondear calificaciones al rango 0-5
         etl_logger.info("Normalizando calificaciones al rango 0-5")
-        calificaciones_fuera_rango = 0
-        
-        def normalizar_nota(nota):
-            """Normaliza las notas al rango 0-5"""
-            nonlocal calificaciones_fuera_rango
-            if pd.isna(nota):
-                return nota
-            # Contar notas fuera del rango
-            if nota < 0 or nota > 5:
-                calificaciones_fuera_rango += 1
-            # Redondear al rango 0-5
-            return max(0, min(5, round(float(nota), 1)))
-        
-        df_ca['nota'] = df_ca['nota'].apply(normalizar_nota)
+        notas = pd.to_numeric(df_ca['nota'], errors='coerce').to_numpy(dtype=np.float64)
+
+        # Contar notas fuera del rango (los NaN no cuentan)
+        fuera_rango = np.isfinite(notas) & ((notas < 0) | (notas > 5))
+        calificaciones_fuera_rango = int(fuera_rango.sum())
+
+        # Redondear y recortar al rango 0-5 (NaN se conserva)
+        df_ca['nota'] = np.clip(np.round(notas, 1), 0.0, 5.0)
         etl_logger.info(f"Calificaciones fuera de rango corregidas: {calificaciones_fuera_rango}")
         logger.info(f"Calificaciones normalizadas al rango 0-5")
 
@@ -199,34 +340,52 @@ def transform(dfs: Dict[str, Any]) -> Dict[str, Any]:
 
         # Filtrar registros válidos (sin nulos en la llave)
         etl_logger.info("Filtrando registros válidos")
-        valid_al = df_al[df_al[key].notna()].copy()
-        valid_ca = df_ca[df_ca[key].notna()].copy()
-        valid_ma = df_ma[df_ma[key].notna()].copy()
+        valid_al = df_al[df_al[key].notna()]
+        valid_ca = df_ca[df_ca[key].notna()]
+        valid_ma = df_ma[df_ma[key].notna()]
+
+        # Proyectar solo las columnas que llegan al dataset final antes del merge
+        cols_al = [key, 'nombre', 'apellido', 'grado', 'correo', 'fecha_nacimiento']
+        cols_ca = [key, 'asignatura', 'nota', 'periodo']
+        cols_ma = [key, 'anio', 'estado', 'jornada']
+        valid_al = valid_al[[c for c in cols_al if c in valid_al.columns]]
+        valid_ca = valid_ca[[c for c in cols_ca if c in valid_ca.columns]]
+        valid_ma = valid_ma[[c for c in cols_ma if c in valid_ma.columns]]
         
         registros_invalidos = (len(df_al) - len(valid_al)) + (len(df_ca) - len(valid_ca)) + (len(df_ma) - len(valid_ma))
         if registros_invalidos > 0:
             etl_logger.warning(f"Registros con ID nulo descartados: {registros_invalidos}")
 
+        # Llave categórica común a las tres tablas: el merge usa los códigos enteros
+        categorias = pd.Index(pd.concat(
+            [valid_al[key].astype(object), valid_ca[key].astype(object), valid_ma[key].astype(object)],
+            ignore_index=True,
+        ).unique())
+        for df in (valid_al, valid_ca, valid_ma):
+            df[key] = pd.Categorical(df[key].astype(object), categories=categorias)
+
         # === MERGES DETALLADOS ===
         etl_logger.info("Ejecutando merge de calificaciones con alumnos")
         # 1. Merge calificaciones con datos de alumnos (mantener detalle por materia)
-        df_temp = valid_ca.merge(valid_al, on=key, how='left')
+        df_temp = valid_ca.merge(valid_al, on=key, how='left', sort=False)
         etl_logger.info(f"Merge calificaciones-alumnos: {len(df_temp)} registros")
         logger.info(f"Después de merge calificaciones con alumnos: {len(df_temp)} filas")
         
         etl_logger.info("Ejecutando merge con datos de matrícula")
         # 2. Merge con datos de matrícula
-        df_final = df_temp.merge(valid_ma, on=key, how='left')
+        df_final = df_temp.merge(valid_ma, on=key, how='left', sort=False)
         etl_logger.info(f"Merge final con matrículas: {len(df_final)} registros")
         logger.info(f"Después de merge con matrículas: {len(df_final)} filas")
         
-        # Verificar que los datos de matrícula se asociaron
-        matriculas_asociadas = df_final[df_final['anio'].notna()].shape[0]
+        # Verificar que los datos de matrícula se asociaron (máscara calculada una sola vez)
+        notna_anio = df_final['anio'].notna().to_numpy()
+        matriculas_asociadas = int(notna_anio.sum())
         etl_logger.info(f"Registros con matrícula asociada: {matriculas_asociadas}")
         logger.info(f"Registros con datos de matrícula asociados: {matriculas_asociadas}")
         
-        # Contar alumnos únicos con matrícula
-        alumnos_unicos_con_matricula = df_final[df_final['anio'].notna()][key].nunique()
+        # Contar alumnos únicos con matrícula sobre los códigos de la llave (reutilizado en las métricas)
+        key_codes = df_final[key].cat.codes.to_numpy()
+        alumnos_unicos_con_matricula = np.unique(key_codes[notna_anio & (key_codes >= 0)]).size
         etl_logger.info(f"Alumnos únicos con matrícula: {alumnos_unicos_con_matricula}")
         logger.info(f"Alumnos únicos con matrícula: {alumnos_unicos_con_matricula}")
 
@@ -244,19 +403,20 @@ def transform(dfs: Dict[str, Any]) -> Dict[str, Any]:
         columnas_finales = [col for col in columnas_ordenadas if col in df_final.columns]
         df_final = df_final[columnas_finales]
 
-        # Guarda salida intermedia
-        etl_logger.info(f"Guardando dataset final en: {FINAL_PARQUET}")
-        df_final.to_parquet(FINAL_PARQUET, index=False)
+        # Guarda copia en Parquet solo si se solicita (load recibe el DataFrame en memoria)
+        if save_parquet:
+            etl_logger.info(f"Guardando dataset final en: {FINAL_PARQUET}")
+            df_final.to_parquet(FINAL_PARQUET, **PARQUET_OPTS)
         
         # Log de muestra de datos finales
         logger.info(f"Muestra de datos finales:\n{df_final.head(10)}")
         logger.info(f"Columnas finales: {list(df_final.columns)}")
         logger.info(f"Ejemplo - Alumno A001 tiene {len(df_final[df_final[key] == 'A001'])} materias")
 
-        # Calcular estadísticas
-        promedio_general = df_final['nota'].mean() if 'nota' in df_final.columns else 0
-        total_alumnos_unicos = df_final[key].nunique()
+        # Calcular estadísticas en una sola pasada sobre arreglos NumPy alineados
+        total_alumnos_unicos = np.unique(key_codes[key_codes >= 0]).size
         total_materias_diferentes = df_final['asignatura'].nunique() if 'asignatura' in df_final.columns else 0
+        promedio_general = np.nanmean(df_final['nota'].to_numpy(dtype=np.float64)) if 'nota' in df_final.columns else 0
 
         end = datetime.utcnow()
         duration = (end - start).total_seconds()
@@ -279,15 +439,15 @@ def transform(dfs: Dict[str, Any]) -> Dict[str, Any]:
             "correos_generados": int(correos_generados)
         }
         logger.info(f"TRANSFORM OK: {metrics}")
-        return {"df_final_path": str(FINAL_PARQUET), "metrics": metrics}
+        return {"df_final": df_final, "metrics": metrics}
         
     except Exception as e:
         etl_logger.error(f"ERROR EN TRANSFORMACIÓN: {str(e)}")
         etl_logger.error(f"Tipo de error: {type(e).__name__}")
         raise
 
-@task
-def load(transform_out: Dict[str, Any]) -> Dict[str, Any]:
+@task(**RESULT_OPTS)
+def load(df_final: pd.DataFrame) -> Dict[str, Any]:
     logger = get_run_logger()
     start = datetime.utcnow()
     
@@ -296,17 +456,23 @@ def load(transform_out: Dict[str, Any]) -> Dict[str, Any]:
     etl_logger.info(f"Timestamp de inicio: {start.isoformat()}")
 
     try:
-        etl_logger.info(f"Leyendo datos transformados desde: {transform_out['df_final_path']}")
-        df_final = pd.read_parquet(transform_out["df_final_path"])
         etl_logger.info(f"Registros a cargar: {len(df_final)}")
 
         # Carga a SQLite
         etl_logger.info(f"Conectando a base de datos: {DB_PATH}")
         conn = sqlite3.connect(DB_PATH)
-        
+        # Ajustes para carga masiva: sin fsync, temporales en memoria
+        # (el modo WAL lo fija _init_monitor y queda guardado en el archivo)
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-200000")
+
         etl_logger.info("Cargando datos en tabla 'hechos' (reemplazando contenido anterior)")
-        df_final.to_sql("hechos", conn, if_exists="replace", index=False)
-        conn.commit()
+        # INSERT multi-fila por lotes, sin superar el límite de parámetros de SQLite
+        chunksize = max(1, min(10_000, SQLITE_MAX_VARIABLES // max(1, len(df_final.columns))))
+        with conn:
+            df_final.to_sql("hechos", conn, if_exists="replace", index=False,
+                            method="multi", chunksize=chunksize)
         
         # Verificar la carga
         cursor = conn.cursor()
@@ -353,32 +519,7 @@ def log_run(extract_m: Dict[str, Any], transform_m: Dict[str, Any], load_m: Dict
     # Para una duración aproximada, medimos en la propia tarea (simple)
     ts_now = datetime.utcnow().isoformat(timespec="seconds")
 
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS etl_monitor (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            run_ts TEXT,
-            registros_leidos INTEGER,
-            registros_validos INTEGER,
-            registros_descartados INTEGER,
-            alumnos_con_matricula INTEGER,
-            total_alumnos_unicos INTEGER,
-            total_materias_diferentes INTEGER,
-            correos_generados INTEGER,
-            promedio_notas_general REAL,
-            duracion_s TEXT,
-            estado TEXT,
-            mensaje TEXT
-        );
-    """)
-    conn.commit()
-    cur.execute("""
-        INSERT INTO etl_monitor(run_ts, registros_leidos, registros_validos, registros_descartados, alumnos_con_matricula, total_alumnos_unicos, total_materias_diferentes, correos_generados, promedio_notas_general, duracion_s, estado, mensaje)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (ts_now, int(registros_leidos), int(registros_validos), int(registros_descartados), int(alumnos_con_matricula), int(total_alumnos_unicos), int(total_materias_diferentes), int(correos_generados), float(promedio_notas), "-", estado, mensaje[:500]))
-    conn.commit()
-    conn.close()
+    _get_monitor().execute(_INSERT_SQL, (ts_now, int(registros_leidos), int(registros_validos), int(registros_descartados), int(alumnos_con_matricula), int(total_alumnos_unicos), int(total_materias_diferentes), int(correos_generados), float(promedio_notas), "-", estado, mensaje[:500]))
 
     resumen = {
         "registros_leidos": registros_leidos,
@@ -395,7 +536,7 @@ def log_run(extract_m: Dict[str, Any], transform_m: Dict[str, Any], load_m: Dict
     logger.info("RESUMEN LAB2 ETL PREFECT: %s", json.dumps(resumen, indent=2))
 
 @flow(name="lab2_etl_prefect")
-def etl_flow():
+def etl_flow(save_parquet: bool = False):
     flow_start = datetime.utcnow()
     etl_logger.info("🚀 ========================================")
     etl_logger.info("🚀 INICIANDO PIPELINE ETL LAB2 CON PREFECT")
@@ -407,10 +548,10 @@ def etl_flow():
         ext = extract()
         
         etl_logger.info("🔄 Ejecutando fase de TRANSFORMACIÓN")
-        trn = transform(ext)
+        trn = transform(ext, save_parquet=save_parquet)
         
         etl_logger.info("💾 Ejecutando fase de CARGA")
-        lod = load(trn)
+        lod = load(trn["df_final"])
         
         # Extraer métricas individuales para el monitor
         extract_metrics = ext["metrics"]
@@ -3,20 +3,57 @@
 ETL Pipeline Simple - Automatizacion con GitHub Actions
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from datetime import datetime
 import pandas as pd
 import sqlite3
 import xml.etree.ElementTree as ET
 import json
 import logging
+import os
+import time
 from pathlib import Path
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.json as pajson
+
+# Copy-on-Write: las selecciones no copian datos hasta que se modifican
+# (siempre activo desde pandas 3.0)
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.options.mode.copy_on_write = True
 
 # Configuración de paths
 DATA_DIR = Path(__file__).resolve().parents[1] / "data"
 DB_PATH = DATA_DIR / "etl.db"
-FINAL_CSV = DATA_DIR / "df_final.csv"
+FINAL_PARQUET = DATA_DIR / "df_final.parquet"
 LOG_PATH = DATA_DIR / "etl.log"
+# Copias raw de los datos extraídos (desactivadas por defecto, p. ej. en CI)
+SAVE_RAW = os.getenv("ETL_SAVE_RAW", "0") == "1"
+# Columnas de baja cardinalidad que se manejan como 'category'
+CATEGORICAL_COLS = ('grado', 'asignatura', 'periodo', 'estado', 'jornada', 'anio')
+# Tabla para normalizar nombres en correos: quita tildes y espacios en una pasada
+_ACCENT_TRANS = str.maketrans({'á': 'a', 'é': 'e', 'í': 'i', 'ó': 'o', 'ú': 'u', ' ': ''})
+
+# Tabla de monitoreo de ejecuciones
+MONITOR_DDL = """
+    CREATE TABLE IF NOT EXISTS etl_monitor (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run_ts TEXT,
+        registros_leidos INTEGER,
+        registros_validos INTEGER,
+        registros_descartados INTEGER,
+        alumnos_con_matricula INTEGER,
+        total_alumnos_unicos INTEGER,
+        total_materias_diferentes INTEGER,
+        correos_generados INTEGER,
+        promedio_notas_general REAL,
+        duracion_s TEXT,
+        estado TEXT,
+        mensaje TEXT
+    );
+"""
 
 def setup_logging():
     """Configura el sistema de logging"""
@@ -25,7 +62,7 @@ def setup_logging():
     # Configurar logging con archivo y consola
     logging.basicConfig(
         level=logging.INFO,
-        format='%(asctime)s | %(levelname)s | %(funcName)s | %(message)s',
+        format='%(asctime)s | %(levelname)s | %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S',
         handlers=[
             logging.FileHandler(LOG_PATH, encoding='utf-8'),
@@ -34,9 +71,75 @@ def setup_logging():
     )
     return logging.getLogger(__name__)
 
+def leer_csv(path):
+    """Lee un CSV con el lector multihilo de pyarrow (pandas como respaldo)"""
+    try:
+        table = pacsv.read_csv(
+            path,
+            read_options=pacsv.ReadOptions(use_threads=True),
+            # Celdas vacías como nulos, igual que pandas
+            convert_options=pacsv.ConvertOptions(strings_can_be_null=True),
+        )
+        # Las fechas se conservan como texto, igual que con pandas
+        table = table.cast(pa.schema([
+            f.with_type(pa.string()) if pa.types.is_date(f.type) else f for f in table.schema
+        ]))
+        return table.to_pandas()
+    except (pa.ArrowException, OSError):
+        return pd.read_csv(path)
+
+def leer_json(path):
+    """Lee un JSON de registros: NDJSON con pyarrow, arreglo JSON con pandas"""
+    with open(path, encoding="utf-8") as f:
+        es_arreglo = f.read(1024).lstrip().startswith("[")
+    if not es_arreglo:
+        try:
+            return pajson.read_json(path).to_pandas()
+        except (pa.ArrowException, OSError):
+            pass
+    return pd.read_json(path, orient="records", lines=not es_arreglo)
+
+def leer_matriculas_xml(path):
+    """Lee matriculas.xml en streaming (iterparse) acumulando columnas en un dict de listas"""
+    cols: dict[str, list] = {}
+    n_rows = 0
+    for _, elem in ET.iterparse(path, events=("end",)):
+        if elem.tag != "matricula":
+            continue
+        for child in elem:
+            col = cols.get(child.tag)
+            if col is None:
+                # Columna nueva: se rellena con None las filas anteriores
+                col = cols[child.tag] = [None] * n_rows
+            else:
+                col.extend([None] * (n_rows - len(col)))
+            col.append(child.text)
+        n_rows += 1
+        # Liberar el subárbol ya procesado
+        elem.clear()
+    for col in cols.values():
+        col.extend([None] * (n_rows - len(col)))
+    # Cada lista se toma directamente como columna
+    return pd.DataFrame(cols, copy=False)
+
+def a_categorias(df):
+    """Convierte a 'category' las columnas de baja cardinalidad presentes"""
+    cols = [c for c in CATEGORICAL_COLS if c in df.columns]
+    return df.astype({c: 'category' for c in cols}) if cols else df
+
+def desde_categorias(df):
+    """Devuelve las columnas 'category' a valores planos antes de escribir en SQLite"""
+    cols = {}
+    for c, dtype in df.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            codes = df[c].cat.codes.to_numpy()
+            valores = pd.api.extensions.take(dtype.categories.to_numpy(), codes, allow_fill=True)
+            cols[c] = pd.Series(valores, index=df.index)
+    return df.assign(**cols) if cols else df
+
 def extract(logger):
     """Fase de extracción"""
-    start = datetime.utcnow()
+    t0 = time.perf_counter_ns()
     logger.info("=== INICIANDO FASE DE EXTRACCIÓN ===")
     
     try:
@@ -45,36 +148,40 @@ def extract(logger):
         calif_json = DATA_DIR / "calificaciones.json"
         matric_xml = DATA_DIR / "matriculas.xml"
         
-        logger.info(f"Leyendo archivo de alumnos: {alumnos_csv}")
-        df_al = pd.read_csv(alumnos_csv)
-        logger.info(f"Alumnos leídos: {len(df_al)} registros")
-        
-        logger.info(f"Leyendo archivo de calificaciones: {calif_json}")
-        df_ca = pd.read_json(calif_json, orient="records", lines=False)
-        logger.info(f"Calificaciones leídas: {len(df_ca)} registros")
+        logger.info("Leyendo archivo de alumnos: %s", alumnos_csv)
+        logger.info("Leyendo archivo de calificaciones: %s", calif_json)
+        logger.info("Leyendo archivo de matrículas: %s", matric_xml)
+        # Las tres lecturas son independientes: se hacen en paralelo
+        with ThreadPoolExecutor(max_workers=3) as ex:
+            f_al = ex.submit(leer_csv, alumnos_csv)
+            f_ca = ex.submit(leer_json, calif_json)
+            f_ma = ex.submit(leer_matriculas_xml, matric_xml)
+            df_al = a_categorias(f_al.result())
+            df_ca = a_categorias(f_ca.result())
+            df_ma = a_categorias(f_ma.result())
+        logger.info("Alumnos leídos: %d registros", len(df_al))
+        logger.info("Calificaciones leídas: %d registros", len(df_ca))
+        logger.info("Matrículas leídas: %d registros", len(df_ma))
 
-        logger.info(f"Leyendo archivo de matrículas: {matric_xml}")
-        tree = ET.parse(matric_xml)
-        root = tree.getroot()
-        rows = []
-        for r in root.findall(".//matricula"):
-            rows.append({child.tag: child.text for child in r})
-        df_ma = pd.DataFrame(rows)
-        logger.info(f"Matrículas leídas: {len(df_ma)} registros")
+        # Generar copias raw (opcionales), cada una en su propio archivo
+        if SAVE_RAW:
+            logger.info("Generando copias raw de los datos originales")
+            raw = {"alumnos": df_al, "calificaciones": df_ca, "matriculas": df_ma}
+            with ThreadPoolExecutor(max_workers=3) as ex:
+                futs = [
+                    ex.submit(df.to_parquet, DATA_DIR / f"raw_{nombre}.parquet",
+                              engine="pyarrow", compression="zstd")
+                    for nombre, df in raw.items()
+                ]
+                for fut in futs:
+                    fut.result()
 
-        # Generar copias raw
-        logger.info("Generando copias raw de los datos originales")
-        df_al.to_csv(DATA_DIR / "raw_alumnos.csv", index=False)
-        df_ca.to_json(DATA_DIR / "raw_calificaciones.json", orient="records", indent=2)
-        df_ma.to_csv(DATA_DIR / "raw_matriculas.csv", index=False)
-
-        end = datetime.utcnow()
-        duration = (end - start).total_seconds()
+        duration = (time.perf_counter_ns() - t0) / 1e9
         total_registros = len(df_al) + len(df_ca) + len(df_ma)
         
         logger.info("=== EXTRACCIÓN COMPLETADA EXITOSAMENTE ===")
-        logger.info(f"Duración: {duration:.2f} segundos")
-        logger.info(f"Total registros extraídos: {total_registros}")
+        logger.info("Duración: %.2f segundos", duration)
+        logger.info("Total registros extraídos: %d", total_registros)
         
         # Métricas de extracción
         extract_metrics = {
@@ -87,58 +194,45 @@ def extract(logger):
         return df_al, df_ca, df_ma, extract_metrics
         
     except Exception as e:
-        logger.error(f"ERROR EN EXTRACCIÓN: {str(e)}")
+        logger.error("ERROR EN EXTRACCIÓN: %s", e)
         raise
 
 def transform(df_al, df_ca, df_ma, logger):
     """Fase de transformación"""
-    start = datetime.utcnow()
+    t0 = time.perf_counter_ns()
     logger.info("=== INICIANDO FASE DE TRANSFORMACIÓN ===")
     
     try:
-        logger.info(f"Datos recibidos - Alumnos: {len(df_al)}, Calificaciones: {len(df_ca)}, Matrículas: {len(df_ma)}")
+        logger.info("Datos recibidos - Alumnos: %d, Calificaciones: %d, Matrículas: %d", len(df_al), len(df_ca), len(df_ma))
 
         # === LIMPIEZA DE DATOS ===
         logger.info("Iniciando limpieza de datos")
         
-        # 1. Eliminar duplicados - crear copia explícita para evitar warning
-        registros_antes = len(df_al)
-        df_al = df_al.drop_duplicates(subset=['id_alumno'], keep='first').copy()
-        duplicados_eliminados = registros_antes - len(df_al)
-        logger.info(f"Duplicados eliminados en alumnos: {duplicados_eliminados}")
+        # 1. Eliminar duplicados - máscara booleana, sin copia completa (Copy-on-Write)
+        mask_unicos = ~df_al['id_alumno'].duplicated(keep='first')
+        duplicados_eliminados = int((~mask_unicos).sum())
+        df_al = df_al.loc[mask_unicos]
+        logger.info("Duplicados eliminados en alumnos: %d", duplicados_eliminados)
         
         # 2. Generar correos faltantes
         logger.info("Generando correos electrónicos faltantes")
-        def generar_correo(row):
-            if pd.isna(row['correo']) or row['correo'] == '':
-                nombre = str(row['nombre']).lower().strip()
-                apellido = str(row['apellido']).lower().strip()
-                nombre_limpio = nombre.replace(' ', '').replace('á', 'a').replace('é', 'e').replace('í', 'i').replace('ó', 'o').replace('ú', 'u')
-                apellido_limpio = apellido.replace(' ', '').replace('á', 'a').replace('é', 'e').replace('í', 'i').replace('ó', 'o').replace('ú', 'u')
-                return f"{nombre_limpio}.{apellido_limpio}@colegio.edu"
-            return row['correo']
+        nombre_limpio = df_al['nombre'].astype(str).str.lower().str.strip().str.translate(_ACCENT_TRANS)
+        apellido_limpio = df_al['apellido'].astype(str).str.lower().str.strip().str.translate(_ACCENT_TRANS)
+        correos_nuevos = nombre_limpio + '.' + apellido_limpio + '@colegio.edu'
+        mask_sin_correo = df_al['correo'].isna() | (df_al['correo'] == '')
         
         correos_faltantes_antes = df_al['correo'].isna().sum()
-        df_al['correo'] = df_al.apply(generar_correo, axis=1)
+        df_al.loc[mask_sin_correo, 'correo'] = correos_nuevos[mask_sin_correo]
         correos_faltantes_despues = df_al['correo'].isna().sum()
         correos_generados = correos_faltantes_antes - correos_faltantes_despues
-        logger.info(f"Correos generados automáticamente: {correos_generados}")
+        logger.info("Correos generados automáticamente: %d", correos_generados)
         
-        # 3. Normalizar calificaciones - crear copia para evitar warning
+        # 3. Normalizar calificaciones - assign sin copia completa (Copy-on-Write)
         logger.info("Normalizando calificaciones al rango 0-5")
-        df_ca = df_ca.copy()
-        calificaciones_fuera_rango = 0
-        
-        def normalizar_nota(nota):
-            nonlocal calificaciones_fuera_rango
-            if pd.isna(nota):
-                return nota
-            if nota < 0 or nota > 5:
-                calificaciones_fuera_rango += 1
-            return max(0, min(5, round(float(nota), 1)))
-        
-        df_ca['nota'] = df_ca['nota'].apply(normalizar_nota)
-        logger.info(f"Calificaciones fuera de rango corregidas: {calificaciones_fuera_rango}")
+        notas = pd.to_numeric(df_ca['nota'], errors='coerce').to_numpy(dtype=np.float64)
+        calificaciones_fuera_rango = int(np.nansum((notas < 0) | (notas > 5)))
+        df_ca = df_ca.assign(nota=np.clip(np.round(notas, 1), 0.0, 5.0))
+        logger.info("Calificaciones fuera de rango corregidas: %d", calificaciones_fuera_rango)
 
         # === VALIDACIÓN DE INTEGRIDAD DE DATOS ===
         logger.info("✅ Validación de integridad de datos completada exitosamente")
@@ -147,20 +241,28 @@ def transform(df_al, df_ca, df_ma, logger):
         logger.info("Iniciando proceso de merge de datos")
         key = "id_alumno"
         
-        # Merge calificaciones con alumnos
-        df_temp = df_ca.merge(df_al, on=key, how='left')
-        logger.info(f"Merge calificaciones-alumnos: {len(df_temp)} registros")
-        
-        # Merge con matrículas
-        df_final = df_temp.merge(df_ma, on=key, how='left')
-        logger.info(f"Merge final con matrículas: {len(df_final)} registros")
+        # Factorizar la llave una sola vez: los merges usan códigos enteros
+        codes, _ = pd.factorize(pd.concat([df_al[key], df_ca[key], df_ma[key]], ignore_index=True))
+        n_al, n_ca = len(df_al), len(df_ca)
+        df_ca = df_ca.assign(_key=codes[n_al:n_al + n_ca])
+        # Tablas derechas indexadas (y ordenadas) por la llave una sola vez
+        df_al_i = df_al.drop(columns=key).assign(_key=codes[:n_al]).set_index('_key').sort_index()
+        df_ma_i = df_ma.drop(columns=key).assign(_key=codes[n_al + n_ca:]).set_index('_key').sort_index()
+        
+        # Join encadenado calificaciones -> alumnos -> matrículas, sin DataFrame intermedio
+        # (id_alumno se conserva desde calificaciones; alumnos ya sin duplicados)
+        df_final = (df_ca.join(df_al_i, on='_key', how='left', rsuffix='_al', validate='m:1')
+                         .join(df_ma_i, on='_key', how='left', rsuffix='_ma')
+                         .drop(columns='_key'))
+        logger.info("Merge final con matrículas: %d registros", len(df_final))
         
         # Verificar asociación de matrículas
-        matriculas_asociadas = df_final[df_final['anio'].notna()].shape[0]
-        alumnos_unicos_con_matricula = df_final[df_final['anio'].notna()][key].nunique()
+        mask_matricula = df_final['anio'].notna()
+        matriculas_asociadas = int(mask_matricula.sum())
+        alumnos_unicos_con_matricula = df_final.loc[mask_matricula, key].nunique()
         
-        logger.info(f"Registros con matrícula asociada: {matriculas_asociadas}")
-        logger.info(f"Alumnos únicos con matrícula: {alumnos_unicos_con_matricula}")
+        logger.info("Registros con matrícula asociada: %d", matriculas_asociadas)
+        logger.info("Alumnos únicos con matrícula: %d", alumnos_unicos_con_matricula)
 
         # Reorganizar columnas
         columnas_ordenadas = [
@@ -168,26 +270,32 @@ def transform(df_al, df_ca, df_ma, logger):
             'asignatura', 'nota', 'periodo', 'anio', 'estado', 'jornada'
         ]
         columnas_finales = [col for col in columnas_ordenadas if col in df_final.columns]
-        df_final = df_final[columnas_finales]
+        # Con Copy-on-Write el reordenamiento comparte los bloques (sin copia)
+        df_final = df_final.reindex(columns=columnas_finales)
 
         # Guardar dataset final
-        logger.info(f"Guardando dataset final en: {FINAL_CSV}")
-        df_final.to_csv(FINAL_CSV, index=False)
-        
-        # Estadísticas finales
-        promedio_general = df_final['nota'].mean() if 'nota' in df_final.columns else 0
-        total_alumnos_unicos = df_final[key].nunique()
-        total_materias_diferentes = df_final['asignatura'].nunique() if 'asignatura' in df_final.columns else 0
+        logger.info("Guardando dataset final en: %s", FINAL_PARQUET)
+        df_final.to_parquet(FINAL_PARQUET, engine="pyarrow", compression="zstd", index=False)
+        
+        # Estadísticas finales en una sola llamada
+        agregaciones = {key: 'nunique'}
+        if 'nota' in df_final.columns:
+            agregaciones['nota'] = 'mean'
+        if 'asignatura' in df_final.columns:
+            agregaciones['asignatura'] = 'nunique'
+        stats = df_final.agg(agregaciones)
+        promedio_general = float(stats.get('nota', 0))
+        total_alumnos_unicos = int(stats[key])
+        total_materias_diferentes = int(stats.get('asignatura', 0))
 
-        end = datetime.utcnow()
-        duration = (end - start).total_seconds()
+        duration = (time.perf_counter_ns() - t0) / 1e9
         
         logger.info("=== TRANSFORMACIÓN COMPLETADA EXITOSAMENTE ===")
-        logger.info(f"Duración: {duration:.2f} segundos")
-        logger.info(f"Registros procesados: {len(df_final)}")
-        logger.info(f"Alumnos únicos: {total_alumnos_unicos}")
-        logger.info(f"Materias diferentes: {total_materias_diferentes}")
-        logger.info(f"Promedio general de notas: {promedio_general:.2f}")
+        logger.info("Duración: %.2f segundos", duration)
+        logger.info("Registros procesados: %d", len(df_final))
+        logger.info("Alumnos únicos: %d", total_alumnos_unicos)
+        logger.info("Materias diferentes: %d", total_materias_diferentes)
+        logger.info("Promedio general de notas: %.2f", promedio_general)
         
         # Calcular registros descartados (registros con id_alumno nulo)
         registros_descartados = 0
@@ -206,196 +314,198 @@ def transform(df_al, df_ca, df_ma, logger):
         return df_final, transform_metrics
         
     except Exception as e:
-        logger.error(f"ERROR EN TRANSFORMACIÓN: {str(e)}")
+        logger.error("ERROR EN TRANSFORMACIÓN: %s", e)
         raise
 
-def load(df_final, logger):
+def setup_db(conn):
+    """Ajusta la conexión para carga masiva y crea la tabla etl_monitor"""
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-200000")
+    with conn:
+        conn.execute(MONITOR_DDL)
+
+def load(df_final, logger, conn):
     """Fase de carga"""
-    start = datetime.utcnow()
+    t0 = time.perf_counter_ns()
     logger.info("=== INICIANDO FASE DE CARGA ===")
     
     try:
-        logger.info(f"Registros a cargar: {len(df_final)}")
-        logger.info(f"Conectando a base de datos: {DB_PATH}")
+        logger.info("Registros a cargar: %d", len(df_final))
         
-        conn = sqlite3.connect(DB_PATH)
         logger.info("Cargando datos en tabla 'hechos' (reemplazando contenido anterior)")
-        df_final.to_sql("hechos", conn, if_exists="replace", index=False)
-        conn.commit()
+        df_sql = desde_categorias(df_final)
+        # Mismo esquema que generaría to_sql; NaN -> NULL como hace pandas
+        esquema = pd.io.sql.get_schema(df_sql, "hechos", con=conn)
+        placeholders = ", ".join("?" * len(df_sql.columns))
+        filas = df_sql.astype(object).where(df_sql.notna(), None).itertuples(index=False, name=None)
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS hechos")
+            conn.execute(esquema)
+            conn.executemany(f"INSERT INTO hechos VALUES ({placeholders})", filas)
         
         # Verificar la carga
         cursor = conn.cursor()
         cursor.execute("SELECT COUNT(*) FROM hechos")
         registros_cargados = cursor.fetchone()[0]
-        logger.info(f"Verificación: {registros_cargados} registros en tabla hechos")
-        
-        conn.close()
-        logger.info("Conexión a base de datos cerrada")
+        logger.info("Verificación: %d registros en tabla hechos", registros_cargados)
 
-        end = datetime.utcnow()
-        duration = (end - start).total_seconds()
+        duration = (time.perf_counter_ns() - t0) / 1e9
         
         logger.info("=== CARGA COMPLETADA EXITOSAMENTE ===")
-        logger.info(f"Duración: {duration:.2f} segundos")
-        logger.info(f"Registros cargados: {registros_cargados}")
+        logger.info("Duración: %.2f segundos", duration)
+        logger.info("Registros cargados: %d", registros_cargados)
         
         return registros_cargados
         
     except Exception as e:
-        logger.error(f"ERROR EN CARGA: {str(e)}")
+        logger.error("ERROR EN CARGA: %s", e)
         raise
 
-def log_run(registros_leidos, registros_validos, registros_descartados, alumnos_con_matricula, 
+def log_run(conn, registros_leidos, registros_validos, registros_descartados, alumnos_con_matricula, 
            total_alumnos_unicos, total_materias_diferentes, correos_generados, 
            promedio_notas_general, duracion_s, estado="OK", mensaje="", logger=None):
     """Registra métricas de la ejecución del ETL en la tabla etl_monitor"""
     try:
         ts_now = datetime.utcnow().isoformat(timespec="seconds")
         
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        
-        # Crear tabla etl_monitor si no existe
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS etl_monitor (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                run_ts TEXT,
-                registros_leidos INTEGER,
-                registros_validos INTEGER,
-                registros_descartados INTEGER,
-                alumnos_con_matricula INTEGER,
-                total_alumnos_unicos INTEGER,
-                total_materias_diferentes INTEGER,
-                correos_generados INTEGER,
-                promedio_notas_general REAL,
-                duracion_s TEXT,
-                estado TEXT,
-                mensaje TEXT
-            );
-        """)
-        conn.commit()
-        
-        # Insertar métricas de la corrida actual
-        cur.execute("""
-            INSERT INTO etl_monitor(run_ts, registros_leidos, registros_validos, registros_descartados, 
-                                  alumnos_con_matricula, total_alumnos_unicos, total_materias_diferentes, 
-                                  correos_generados, promedio_notas_general, duracion_s, estado, mensaje)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (ts_now, int(registros_leidos), int(registros_validos), int(registros_descartados), 
-              int(alumnos_con_matricula), int(total_alumnos_unicos), int(total_materias_diferentes), 
-              int(correos_generados), float(promedio_notas_general), str(duracion_s), estado, mensaje[:500]))
-        
-        conn.commit()
-        conn.close()
+        # Insertar métricas de la corrida actual (tabla creada en setup_db)
+        with conn:
+            conn.execute("""
+                INSERT INTO etl_monitor(run_ts, registros_leidos, registros_validos, registros_descartados, 
+                                      alumnos_con_matricula, total_alumnos_unicos, total_materias_diferentes, 
+                                      correos_generados, promedio_notas_general, duracion_s, estado, mensaje)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (ts_now, int(registros_leidos), int(registros_validos), int(registros_descartados), 
+                  int(alumnos_con_matricula), int(total_alumnos_unicos), int(total_materias_diferentes), 
+                  int(correos_generados), float(promedio_notas_general), str(duracion_s), estado, mensaje[:500]))
         
         if logger:
-            logger.info(f"Métricas registradas en tabla etl_monitor: {estado}")
+            logger.info("Métricas registradas en tabla etl_monitor: %s", estado)
             
     except Exception as e:
         if logger:
-            logger.error(f"Error al registrar métricas en etl_monitor: {str(e)}")
+            logger.error("Error al registrar métricas en etl_monitor: %s", e)
         else:
             print(f"Error al registrar métricas en etl_monitor: {str(e)}")
 
 def main():
     """Función principal del ETL"""
-    flow_start = datetime.utcnow()
+    # Reloj monotónico para duraciones; datetime solo para los timestamps
+    t0 = time.perf_counter_ns()
+    flow_start_iso = datetime.utcnow().isoformat()
     logger = setup_logging()
     
     logger.info("🚀 ========================================")
     logger.info("🚀 INICIANDO PIPELINE ETL LAB2")
     logger.info("🚀 ========================================")
-    logger.info(f"🚀 Timestamp de inicio: {flow_start.isoformat()}")
+    logger.info("🚀 Timestamp de inicio: %s", flow_start_iso)
     
+    # Una sola conexión para la carga y el registro de métricas
     try:
-        logger.info("📥 Ejecutando fase de EXTRACCIÓN")
-        df_al, df_ca, df_ma, extract_metrics = extract(logger)
-        
-        logger.info("🔄 Ejecutando fase de TRANSFORMACIÓN")
-        df_final, transform_metrics = transform(df_al, df_ca, df_ma, logger)
-        
-        logger.info("💾 Ejecutando fase de CARGA")
-        registros_cargados = load(df_final, logger)
-        
-        flow_end = datetime.utcnow()
-        total_duration = (flow_end - flow_start).total_seconds()
-        
-        # Registrar métricas en tabla etl_monitor
-        logger.info("📊 Registrando métricas de ejecución")
-        log_run(
-            registros_leidos=extract_metrics['total_registros'],
-            registros_validos=transform_metrics['registros_validos'],
-            registros_descartados=transform_metrics['registros_descartados'],
-            alumnos_con_matricula=transform_metrics['alumnos_con_matricula'],
-            total_alumnos_unicos=transform_metrics['total_alumnos_unicos'],
-            total_materias_diferentes=transform_metrics['total_materias_diferentes'],
-            correos_generados=transform_metrics['correos_generados'],
-            promedio_notas_general=transform_metrics['promedio_notas_general'],
-            duracion_s=round(total_duration, 2),
-            estado="OK",
-            mensaje="ETL ejecutado exitosamente",
-            logger=logger
-        )
+        conn = sqlite3.connect(DB_PATH)
+    except Exception as e:
+        # Sin conexión no hay etl_monitor donde registrar el fallo
+        logger.error("❌ Error al conectar a la base de datos %s: %s", DB_PATH, e)
+        return False
+
+    with closing(conn):
+        try:
+            setup_db(conn)
+
+            logger.info("📥 Ejecutando fase de EXTRACCIÓN")
+            df_al, df_ca, df_ma, extract_metrics = extract(logger)
         
-        logger.info("✅ ========================================")
-        logger.info("✅ PIPELINE ETL COMPLETADO EXITOSAMENTE")
-        logger.info("✅ ========================================")
-        logger.info(f"✅ Duración total: {total_duration:.2f} segundos")
-        logger.info(f"✅ Registros procesados: {len(df_final)}")
-        logger.info(f"✅ Alumnos únicos: {transform_metrics['total_alumnos_unicos']}")
-        logger.info(f"✅ Correos generados: {transform_metrics['correos_generados']}")
-        logger.info(f"✅ Timestamp de finalización: {flow_end.isoformat()}")
-        
-        # Resumen final - convertir todos los valores a tipos Python
-        resumen = {
-            "duracion_total_segundos": round(float(total_duration), 2),
-            "registros_procesados": int(len(df_final)),
-            "registros_cargados": int(registros_cargados),
-            "alumnos_unicos": int(transform_metrics['total_alumnos_unicos']),
-            "materias_diferentes": int(transform_metrics['total_materias_diferentes']),
-            "correos_generados": int(transform_metrics['correos_generados']),
-            "promedio_notas_general": round(float(transform_metrics['promedio_notas_general']), 2),
-            "estado": "EXITOSO",
-            "timestamp": flow_end.isoformat()
-        }
+            logger.info("🔄 Ejecutando fase de TRANSFORMACIÓN")
+            df_final, transform_metrics = transform(df_al, df_ca, df_ma, logger)
         
-        logger.info("📊 RESUMEN FINAL ETL:")
-        logger.info(json.dumps(resumen, indent=2, ensure_ascii=False))
+            logger.info("💾 Ejecutando fase de CARGA")
+            registros_cargados = load(df_final, logger, conn)
         
-        return True
+            total_duration = (time.perf_counter_ns() - t0) / 1e9
+            flow_end_iso = datetime.utcnow().isoformat()
         
-    except Exception as e:
-        flow_end = datetime.utcnow()
-        total_duration = (flow_end - flow_start).total_seconds()
-        
-        logger.error("❌ ========================================")
-        logger.error("❌ ERROR EN PIPELINE ETL")
-        logger.error("❌ ========================================")
-        logger.error(f"❌ Error: {str(e)}")
-        logger.error(f"❌ Tipo de error: {type(e).__name__}")
-        logger.error(f"❌ Duración hasta el error: {total_duration:.2f} segundos")
-        logger.error(f"❌ Timestamp del error: {flow_end.isoformat()}")
-        
-        # Registrar métricas de fallo en etl_monitor
-        try:
+            # Registrar métricas en tabla etl_monitor
+            logger.info("📊 Registrando métricas de ejecución")
             log_run(
-                registros_leidos=0,
-                registros_validos=0,
-                registros_descartados=0,
-                alumnos_con_matricula=0,
-                total_alumnos_unicos=0,
-                total_materias_diferentes=0,
-                correos_generados=0,
-                promedio_notas_general=0.0,
+                conn,
+                registros_leidos=extract_metrics['total_registros'],
+                registros_validos=transform_metrics['registros_validos'],
+                registros_descartados=transform_metrics['registros_descartados'],
+                alumnos_con_matricula=transform_metrics['alumnos_con_matricula'],
+                total_alumnos_unicos=transform_metrics['total_alumnos_unicos'],
+                total_materias_diferentes=transform_metrics['total_materias_diferentes'],
+                correos_generados=transform_metrics['correos_generados'],
+                promedio_notas_general=transform_metrics['promedio_notas_general'],
                 duracion_s=round(total_duration, 2),
-                estado="FAIL",
-                mensaje=f"Error: {str(e)}",
+                estado="OK",
+                mensaje="ETL ejecutado exitosamente",
                 logger=logger
             )
-        except Exception as log_error:
-            logger.error(f"Error adicional al registrar métricas de fallo: {str(log_error)}")
         
-        return False
+            logger.info("✅ ========================================")
+            logger.info("✅ PIPELINE ETL COMPLETADO EXITOSAMENTE")
+            logger.info("✅ ========================================")
+            logger.info("✅ Duración total: %.2f segundos", total_duration)
+            logger.info("✅ Registros procesados: %d", len(df_final))
+            logger.info("✅ Alumnos únicos: %d", transform_metrics['total_alumnos_unicos'])
+            logger.info("✅ Correos generados: %d", transform_metrics['correos_generados'])
+            logger.info("✅ Timestamp de finalización: %s", flow_end_iso)
+        
+            # Resumen final - convertir todos los valores a tipos Python
+            resumen = {
+                "duracion_total_segundos": round(float(total_duration), 2),
+                "registros_procesados": int(len(df_final)),
+                "registros_cargados": int(registros_cargados),
+                "alumnos_unicos": int(transform_metrics['total_alumnos_unicos']),
+                "materias_diferentes": int(transform_metrics['total_materias_diferentes']),
+                "correos_generados": int(transform_metrics['correos_generados']),
+                "promedio_notas_general": round(float(transform_metrics['promedio_notas_general']), 2),
+                "estado": "EXITOSO",
+                "timestamp": flow_end_iso
+            }
+        
+            # Serializar el resumen solo si el nivel INFO está habilitado
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("📊 RESUMEN FINAL ETL:")
+                logger.info("%s", json.dumps(resumen, indent=2, ensure_ascii=False))
+        
+            return True
+        
+        except Exception as e:
+            total_duration = (time.perf_counter_ns() - t0) / 1e9
+            flow_end_iso = datetime.utcnow().isoformat()
+        
+            logger.error("❌ ========================================")
+            logger.error("❌ ERROR EN PIPELINE ETL")
+            logger.error("❌ ========================================")
+            logger.error("❌ Error: %s", e)
+            logger.error("❌ Tipo de error: %s", type(e).__name__)
+            logger.error("❌ Duración hasta el error: %.2f segundos", total_duration)
+            logger.error("❌ Timestamp del error: %s", flow_end_iso)
+        
+            # Registrar métricas de fallo en etl_monitor
+            try:
+                log_run(
+                    conn,
+                    registros_leidos=0,
+                    registros_validos=0,
+                    registros_descartados=0,
+                    alumnos_con_matricula=0,
+                    total_alumnos_unicos=0,
+                    total_materias_diferentes=0,
+                    correos_generados=0,
+                    promedio_notas_general=0.0,
+                    duracion_s=round(total_duration, 2),
+                    estado="FAIL",
+                    mensaje=f"Error: {str(e)}",
+                    logger=logger
+                )
+            except Exception as log_error:
+                logger.error("Error adicional al registrar métricas de fallo: %s", log_error)
+        
+            return False
 
 if __name__ == "__main__":
     success = main()